@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
+import base64
 import json
 import getpass
+import os
 from pathlib import Path
 
 
@@ -35,7 +37,10 @@ def create_secure_config():
     port = input("Node port [8080]: ") or "8080"
     share_dir = input("Share directory [./shared]: ") or "./shared"
 
-    # Create config - only node section
+    # Random per-deployment salt for key derivation
+    salt = base64.b64encode(os.urandom(16)).decode('ascii')
+
+    # Create config - node and crypto sections
     config = {
         "node": {
             "host": host,
@@ -43,6 +48,9 @@ def create_secure_config():
             "share_dir": share_dir,
             "key": key,
             "max_connections": 10
+        },
+        "crypto": {
+            "salt": salt
         }
     }
 
@@ -53,6 +61,8 @@ def create_secure_config():
         print(f"✅ Configuration saved to {config_path}")
         print("\n🚀 You can now start the node:")
         print(f"   python p2p_node.py --config {config_path}")
+        print("\n🔑 Clients need the same crypto salt; share this file and run:")
+        print(f"   python p2p_client.py --config {config_path} ...")
     except Exception as e:
         print(f"❌ Error saving config: {e}")
 
@@ -1,4 +1,6 @@
 import json
+import os
+import pickle
 from pathlib import Path
 from typing import Dict, Any, Optional
 
@@ -12,7 +14,11 @@ class Config:
                 "port": 8080,
                 "share_dir": "./shared",
                 "key": "default_password_123456",  # Longer default key
-                "max_connections": 10
+                "max_connections": 10,
+                # SO_SNDBUF/SO_RCVBUF in bytes for client connections. 0 keeps
+                # the kernel's autotuning, which is usually best; the value is
+                # capped by net.core.wmem_max/rmem_max.
+                "socket_buffer": 0
             },
             "client": {
                 "default_host": "localhost",
@@ -29,6 +35,24 @@ class Config:
                 "username": "",
                 "password": ""
             },
+            "crypto": {
+                # Key derivation: pbkdf2, scrypt or argon2. Must match on all peers.
+                "kdf": "pbkdf2",
+                # Chunk cipher: aes-gcm, or chacha20-poly1305 for CPUs without
+                # AES-NI. Must match on all peers.
+                "cipher": "aes-gcm",
+                "iterations": 100000,  # PBKDF2 only
+                # Base64 KDF salt generated by create_config.py. Empty falls
+                # back to the legacy fixed salt.
+                "salt": "",
+                # Cache the derived key under ~/.cache/p2p-fileshare to skip
+                # key derivation on startup. Only enable on trusted machines.
+                "cache_key": False,
+                # Node only: send chunks unencrypted with sendfile (zero-copy).
+                # Anyone who can reach the node can then read the files; only
+                # use on trusted networks or behind a TLS tunnel.
+                "encrypt_chunks": True
+            },
             "tor": {
                 "enabled": False,
                 "control_port": 9051,
@@ -40,22 +64,63 @@ class Config:
                 "max_size_mb": 10
             }
         }
-        self.config = self.default_config.copy()
+        # User overrides are kept as loaded and consulted before the defaults
+        # on each lookup, instead of being merged into a copy up front
+        self._user: Dict[str, Dict] = {}
         self.load_config()
 
     def load_config(self) -> None:
         """Load configuration from file"""
         if self.config_path.exists():
             try:
-                with open(self.config_path, 'r') as f:
-                    user_config = json.load(f)
-                self._deep_update(self.config, user_config)
+                self._user = self._read_user_config()
                 print(f"✓ Loaded configuration from {self.config_path}")
             except Exception as e:
                 print(f"✗ Error loading config file: {e}. Using defaults.")
         else:
             self.create_default_config()
 
+    def _read_user_config(self) -> Dict:
+        """Parse the config file, reusing a pickled copy while the file is unchanged"""
+        st = self.config_path.stat()
+        stamp = (st.st_mtime_ns, st.st_size)
+        cache_path = self.config_path.with_name(self.config_path.name + '.cache')
+
+        try:
+            with open(cache_path, 'rb') as f:
+                # Unpickling runs code, so only trust a cache nobody else could have written
+                if self._is_private(os.fstat(f.fileno())):
+                    cached_stamp, user_config = pickle.load(f)
+                    if cached_stamp == stamp:
+                        return user_config
+        except Exception:
+            pass
+
+        with open(self.config_path, 'r') as f:
+            user_config = json.load(f)
+
+        # The cache holds the keys from the config, so it is created owner-only
+        tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+        try:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with open(fd, 'wb') as f:
+                pickle.dump((stamp, user_config), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+        return user_config
+
+    @staticmethod
+    def _is_private(st) -> bool:
+        """True if a file is owned by the current user and not writable by others"""
+        if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+            return False
+        return not st.st_mode & 0o077
+
     def create_default_config(self) -> None:
         """Create default configuration file"""
         try:
@@ -67,26 +132,33 @@ class Config:
         except Exception as e:
             print(f"✗ Error creating config file: {e}")
 
-    def _deep_update(self, target: Dict, source: Dict) -> None:
-        """Recursively update nested dictionaries"""
-        for key, value in source.items():
-            if isinstance(value, dict) and key in target and isinstance(target[key], dict):
-                self._deep_update(target[key], value)
-            else:
-                target[key] = value
+    @property
+    def config(self) -> Dict:
+        """Effective configuration: defaults with user overrides applied"""
+        sections = list(self.default_config) + [s for s in self._user if s not in self.default_config]
+        return {section: self._section(section) for section in sections}
+
+    def _section(self, section: str) -> Dict:
+        user_section = self._user.get(section, {})
+        if not isinstance(user_section, dict):
+            return user_section
+        return {**self.default_config.get(section, {}), **user_section}
 
     def get(self, section: str, key: str, default: Any = None) -> Any:
         """Get a configuration value"""
         try:
-            return self.config.get(section, {}).get(key, default)
-        except (KeyError, AttributeError):
+            user_section = self._user.get(section, {})
+            if key in user_section:
+                return user_section[key]
+            return self.default_config.get(section, {}).get(key, default)
+        except (KeyError, AttributeError, TypeError):
             return default
 
     def set(self, section: str, key: str, value: Any) -> None:
         """Set a configuration value"""
-        if section not in self.config:
-            self.config[section] = {}
-        self.config[section][key] = value
+        if section not in self._user:
+            self._user[section] = {}
+        self._user[section][key] = value
 
     def save(self) -> None:
         """Save current configuration to file"""
@@ -112,11 +184,15 @@ class Config:
 
     def get_node_config(self) -> Dict:
         """Get node configuration"""
-        return self.config.get('node', {})
+        return self._section('node')
 
     def get_client_config(self) -> Dict:
         """Get client configuration"""
-        return self.config.get('client', {})
+        return self._section('client')
+
+    def get_crypto_config(self) -> Dict:
+        """Get crypto configuration"""
+        return self._section('crypto')
 
     def validate_key(self, key: str) -> bool:
         """Validate that key meets requirements"""
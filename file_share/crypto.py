@@ -1,13 +1,92 @@
 import os
-import hashlib
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import base64
+import functools
+import hashlib
+import hmac
+from pathlib import Path
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+
+try:
+    from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
+except ImportError:  # cryptography < 44
+    Argon2id = None
+
+# Chunk ciphers; node and client must use the same one. AES-GCM is fastest
+# with AES-NI/PCLMULQDQ, ChaCha20-Poly1305 on CPUs without them (older ARM).
+CIPHERS = {'aes-gcm': AESGCM, 'chacha20-poly1305': ChaCha20Poly1305}
+DEFAULT_CIPHER = 'aes-gcm'
+# Both ciphers use a 96-bit nonce and a 128-bit tag
+NONCE_SIZE = 12
+TAG_SIZE = 16
+# Bytes added by encrypt(): nonce prefix + tag
+OVERHEAD = NONCE_SIZE + TAG_SIZE
+# One SHA-256 output: PBKDF2 computes a single block for this length, so there
+# is no per-block work to spread across cores
+KEY_SIZE = 32
+# Legacy fixed salt, used only when the configuration does not provide one
+SALT = b'p2p_file_share_salt'
+KEY_CACHE_DIR = Path.home() / '.cache' / 'p2p-fileshare' / 'keycache'
+
+# Key derivation functions; node and client must use the same settings.
+# iterations applies to pbkdf2 only, scrypt and argon2 use the costs below.
+KDFS = ('pbkdf2', 'scrypt', 'argon2')
+DEFAULT_KDF = 'pbkdf2'
+DEFAULT_ITERATIONS = 100000
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 15, 8, 1
+# scrypt needs 128 * r * n bytes (32 MiB here), above hashlib's default limit
+SCRYPT_MAXMEM = 64 * 1024 * 1024
+ARGON2_TIME_COST, ARGON2_MEMORY_KIB, ARGON2_LANES = 3, 64 * 1024, 4
+
+
+@functools.lru_cache(maxsize=16)
+def derive_key(key_bytes, salt, kdf=DEFAULT_KDF, iterations=DEFAULT_ITERATIONS):
+    """Derive a KEY_SIZE-byte key from a password.
+
+    Memoized per process, so repeated Crypto constructions with the same
+    settings only pay for the KDF once.
+    """
+    # PBKDF2 and scrypt go straight to OpenSSL's C implementations via hashlib
+    if kdf == 'scrypt':
+        return hashlib.scrypt(key_bytes, salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P,
+                              maxmem=SCRYPT_MAXMEM, dklen=KEY_SIZE)
+    if kdf == 'argon2':
+        return Argon2id(salt=salt, length=KEY_SIZE, iterations=ARGON2_TIME_COST,
+                        lanes=ARGON2_LANES, memory_cost=ARGON2_MEMORY_KIB).derive(key_bytes)
+    return hashlib.pbkdf2_hmac('sha256', key_bytes, salt, iterations, KEY_SIZE)
 
 
 class Crypto:
-    def __init__(self, key=None):
+    """Password-derived AEAD cipher (AES-GCM or ChaCha20-Poly1305) for file chunks.
+
+    The AEAD object is built once per instance and keeps the expanded key
+    schedule, so create one Crypto per peer/process and reuse it for every
+    chunk; never construct one inside a per-chunk loop.
+    """
+
+    def __init__(self, key=None, cache_key=False, kdf=DEFAULT_KDF, iterations=DEFAULT_ITERATIONS, salt=None,
+                 cipher=DEFAULT_CIPHER):
+        self._validate(key, kdf, iterations, cipher)
+
+        if not salt:
+            print("⚠ No crypto salt configured, using the legacy shared salt. "
+                  "Run create_config.py to generate one.")
+            salt = SALT
+
+        self.raw_key = key
+        self.salt = salt
+        self.cache_key = cache_key
+        self.kdf = kdf
+        self.iterations = iterations
+        self.cipher = cipher
+
+        # Derive a 256-bit key from the password
+        self.derived = self._derive(key)
+        self.aead = CIPHERS[cipher](self.derived)
+
+    @staticmethod
+    def _validate(key, kdf, iterations, cipher):
+        """Reject settings the cipher cannot be built from"""
         if key is None:
             raise ValueError("Encryption key is required")
 
@@ -15,29 +94,122 @@ class Crypto:
         if len(key) < 8:
             raise ValueError("Key must be at least 8 characters long")
 
-        self.raw_key = key
-
-        # Derive a proper Fernet key from the password
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=b'p2p_file_share_salt',
-            iterations=100000,
+        if kdf not in KDFS:
+            raise ValueError(f"Unknown KDF '{kdf}', expected one of: {', '.join(KDFS)}")
+        if kdf == 'argon2' and Argon2id is None:
+            raise ValueError("The argon2 KDF requires cryptography 44 or newer")
+        if kdf == 'pbkdf2' and (not isinstance(iterations, int) or iterations < 1):
+            raise ValueError(f"PBKDF2 iterations must be a positive integer, got {iterations!r}")
+        if cipher not in CIPHERS:
+            raise ValueError(f"Unknown cipher '{cipher}', expected one of: {', '.join(CIPHERS)}")
+
+    @staticmethod
+    def _decode_salt(value):
+        """Decode the base64 salt from the configuration"""
+        try:
+            return base64.b64decode(value or '', validate=True)
+        except ValueError:
+            raise ValueError("crypto.salt is not valid base64") from None
+
+    @classmethod
+    def check_config(cls, key, crypto_config):
+        """Validate a key and 'crypto' section without running the KDF.
+
+        Raises ValueError for anything from_config would reject, so callers
+        that derive the key lazily can still fail at startup.
+        """
+        cls._validate(
+            key,
+            crypto_config.get('kdf', DEFAULT_KDF),
+            crypto_config.get('iterations', DEFAULT_ITERATIONS),
+            crypto_config.get('cipher', DEFAULT_CIPHER),
+        )
+        cls._decode_salt(crypto_config.get('salt'))
+
+    @classmethod
+    def from_config(cls, key, crypto_config):
+        """Build a Crypto from the 'crypto' section of the configuration"""
+        return cls(
+            key,
+            cache_key=crypto_config.get('cache_key', False),
+            kdf=crypto_config.get('kdf', DEFAULT_KDF),
+            iterations=crypto_config.get('iterations', DEFAULT_ITERATIONS),
+            salt=cls._decode_salt(crypto_config.get('salt')),
+            cipher=crypto_config.get('cipher', DEFAULT_CIPHER),
         )
-        key_bytes = key.encode() if isinstance(key, str) else key
-        key_base64 = base64.urlsafe_b64encode(kdf.derive(key_bytes))
-        self.fernet = Fernet(key_base64)
 
-        # Store key hash for verification
-        self.key_hash = hashlib.sha256(key.encode()).hexdigest()
+    def _derive(self, key):
+        """Run the password through the KDF, going through the key cache if enabled"""
+        key_bytes = key.encode() if isinstance(key, str) else key
+        derived_key = self._load_cached_key(key_bytes) if self.cache_key else None
+        if derived_key is None:
+            derived_key = derive_key(key_bytes, self.salt, self.kdf, self.iterations)
+            if self.cache_key:
+                self._store_cached_key(key_bytes, derived_key)
+        return derived_key
+
+    def _key_cache_path(self, key_bytes):
+        # KDF settings are part of the name so changing them never hits a stale key
+        params = f"{self.kdf}:{self.iterations}:".encode()
+        return KEY_CACHE_DIR / hashlib.sha256(params + self.salt + key_bytes).hexdigest()
+
+    def _load_cached_key(self, key_bytes):
+        """Load a previously derived key from the on-disk cache.
+
+        The cache stores KDF output in plain form, so it is only meant for
+        trusted single-user machines (see the crypto.cache_key option).
+        """
+        cache_path = self._key_cache_path(key_bytes)
+        try:
+            st = cache_path.stat()
+            # Ignore cache entries readable by anyone but the owner
+            if st.st_mode & 0o077 or st.st_size != KEY_SIZE:
+                return None
+            return cache_path.read_bytes()
+        except OSError:
+            return None
+
+    def _store_cached_key(self, key_bytes, derived_key):
+        """Atomically write a derived key to the on-disk cache"""
+        cache_path = self._key_cache_path(key_bytes)
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        try:
+            KEY_CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(derived_key)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"⚠ Could not cache derived key: {e}")
+            tmp_path.unlink(missing_ok=True)
 
     def encrypt(self, data):
         if isinstance(data, str):
             data = data.encode()
-        return self.fernet.encrypt(data)
+        # Output layout: nonce || ciphertext || 16-byte tag
+        nonce = os.urandom(NONCE_SIZE)
+        if not hasattr(self.aead, 'encrypt_into'):
+            return nonce + self.aead.encrypt(nonce, data, None)
+        # Encrypt in place after the nonce instead of concatenating a copy
+        out = bytearray(len(data) + OVERHEAD)
+        out[:NONCE_SIZE] = nonce
+        self.aead.encrypt_into(nonce, data, None, memoryview(out)[NONCE_SIZE:])
+        return out
 
     def decrypt(self, encrypted_data):
-        return self.fernet.decrypt(encrypted_data)
+        encrypted_data = memoryview(encrypted_data)
+        return self.aead.decrypt(encrypted_data[:NONCE_SIZE], encrypted_data[NONCE_SIZE:], None)
+
+    def decrypt_into(self, encrypted_data, buf):
+        """Decrypt into a preallocated buffer and return a view of the plaintext"""
+        encrypted_data = memoryview(encrypted_data)
+        out = memoryview(buf)[:len(encrypted_data) - OVERHEAD]
+        if hasattr(self.aead, 'decrypt_into'):
+            self.aead.decrypt_into(encrypted_data[:NONCE_SIZE], encrypted_data[NONCE_SIZE:], None, out)
+        else:
+            # cryptography releases without the *_into AEAD API
+            out[:] = self.aead.decrypt(encrypted_data[:NONCE_SIZE], encrypted_data[NONCE_SIZE:], None)
+        return out
 
     def encrypt_file(self, file_path):
         with open(file_path, 'rb') as f:
@@ -64,5 +236,8 @@ class Crypto:
 
     def verify_key(self, test_key):
         """Verify if a key matches the current key"""
-        test_hash = hashlib.sha256(test_key.encode()).hexdigest()
-        return test_hash == self.key_hash
+        # Candidate passwords must not end up in the key cache or the memo,
+        # so call the unwrapped KDF directly
+        key_bytes = test_key.encode() if isinstance(test_key, str) else test_key
+        candidate = derive_key.__wrapped__(key_bytes, self.salt, self.kdf, self.iterations)
+        return hmac.compare_digest(self.derived, candidate)
@@ -1,7 +1,15 @@
 import os
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from file_share.jsonutil import dumps, loads
+
+# Sidecar cache of file hashes keyed by (size, mtime_ns), so unchanged files
+# are not re-read on every scan. Dotfiles are never shared, so it stays hidden.
+INDEX_FILE = '.p2p_index.json'
+HASH_ALGO = 'sha256'
+
 
 class FileHandler:
     def __init__(self, share_dir):
@@ -20,36 +28,105 @@ class FileHandler:
             print(f"✗ Error creating share directory: {e}")
             raise
 
+        self.index_path = self.share_dir / INDEX_FILE
+        self.hash_cache = self._load_index()
         self.file_index = {}
+        self._names_cached = ()
         self._scan_files()
 
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'rb') as f:
+                return loads(f.read())
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"⚠ Ignoring unreadable file index {self.index_path}: {e}")
+            return {}
+
+    def _save_index(self):
+        tmp_path = self.index_path.with_name(INDEX_FILE + '.tmp')
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(dumps(self.hash_cache))
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            print(f"✗ Error saving file index: {e}")
+
     def _scan_files(self):
         self.file_index = {}
         try:
-            for file_path in self.share_dir.glob('*'):
-                if file_path.is_file() and not file_path.name.startswith('.'):
-                    self.file_index[file_path.name] = {
-                        'path': str(file_path),
-                        'size': file_path.stat().st_size,
-                        'hash': self._calculate_hash(file_path)
-                    }
+            entries = [
+                (file_path, file_path.stat())
+                for file_path in self.share_dir.glob('*')
+                if file_path.is_file() and not file_path.name.startswith('.')
+            ]
+
+            # Only files whose size/mtime changed need hashing; hashlib releases
+            # the GIL, so these scale across cores up to disk bandwidth
+            stale = [file_path for file_path, st in entries if self._cached_hash(file_path, st) is None]
+            fresh_hashes = {}
+            if stale:
+                with ThreadPoolExecutor(max_workers=min(len(stale), os.cpu_count() or 1)) as executor:
+                    fresh_hashes = dict(zip(stale, executor.map(self._calculate_hash, stale)))
+
+            for file_path, st in entries:
+                file_hash = fresh_hashes.get(file_path) or self._cached_hash(file_path, st)
+                self._record(file_path, st, file_hash)
+
+            # Drop cache entries for files that are gone
+            for name in set(self.hash_cache) - set(self.file_index):
+                del self.hash_cache[name]
+            self._save_index()
+            self._names_cached = tuple(self.file_index)
             print(f"✓ Found {len(self.file_index)} files in share directory")
         except Exception as e:
             print(f"✗ Error scanning files: {e}")
 
+    def _cached_hash(self, file_path, st):
+        cached = self.hash_cache.get(file_path.name)
+        if (cached and cached.get('algo') == HASH_ALGO
+                and cached['size'] == st.st_size and cached['mtime_ns'] == st.st_mtime_ns):
+            return cached['hash']
+        return None
+
+    def _index_one(self, file_path):
+        st = file_path.stat()
+        file_hash = self._cached_hash(file_path, st) or self._calculate_hash(file_path)
+        self._record(file_path, st, file_hash)
+
+    def _record(self, file_path, st, file_hash):
+        if file_hash != "error":
+            self.hash_cache[file_path.name] = {
+                'size': st.st_size,
+                'mtime_ns': st.st_mtime_ns,
+                'algo': HASH_ALGO,
+                'hash': file_hash
+            }
+
+        self.file_index[file_path.name] = {
+            'path': str(file_path),
+            'size': st.st_size,
+            'hash': file_hash
+        }
+
     def _calculate_hash(self, file_path):
         try:
-            hash_md5 = hashlib.md5()
             with open(file_path, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hash_md5.update(chunk)
-            return hash_md5.hexdigest()
+                if hasattr(hashlib, 'file_digest'):
+                    # Python 3.11+: C read loop that releases the GIL
+                    return hashlib.file_digest(f, HASH_ALGO).hexdigest()
+                hasher = hashlib.new(HASH_ALGO)
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    hasher.update(chunk)
+                return hasher.hexdigest()
         except Exception as e:
             print(f"✗ Error calculating hash for {file_path}: {e}")
             return "error"
 
     def list_files(self):
-        return list(self.file_index.keys())
+        # Immutable snapshot, rebuilt only when the index changes
+        return self._names_cached
 
     def get_file_info(self, filename):
         return self.file_index.get(filename)
@@ -62,7 +139,9 @@ class FileHandler:
             dest_path = self.share_dir / filename
             import shutil
             shutil.copy2(source_path, dest_path)
-            self._scan_files()
+            self._index_one(dest_path)
+            self._save_index()
+            self._names_cached = tuple(self.file_index)
             return filename
         except Exception as e:
             print(f"✗ Error adding file {source_path}: {e}")
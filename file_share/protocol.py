@@ -0,0 +1,128 @@
+import struct
+
+from file_share.jsonutil import dumps, loads
+
+# Every message on the wire is a 4-byte big-endian length followed by the payload.
+# Control messages are UTF-8 JSON; a successful download_chunk response header is
+# followed by one extra frame carrying the raw encrypted chunk.
+FRAME_HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024  # 1MB file chunks
+RECV_SIZE = 16 * 1024
+
+
+def pack_frame(payload):
+    """Prefix a payload with its length header"""
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def recv_exact_into(sock, view):
+    """Fill a writable memoryview from the socket without intermediate copies"""
+    received = 0
+    while received < len(view):
+        n = sock.recv_into(view[received:])
+        if not n:
+            raise ConnectionError("Connection closed by peer")
+        received += n
+
+
+def recv_exact(sock, size):
+    """Receive exactly size bytes, raising ConnectionError if the peer hangs up"""
+    buf = bytearray(size)
+    recv_exact_into(sock, memoryview(buf))
+    return buf
+
+
+def recv_frame_into(sock, buf):
+    """Receive a frame into a preallocated buffer and return a view of the payload"""
+    (size,) = FRAME_HEADER.unpack(recv_exact(sock, FRAME_HEADER.size))
+    if size > len(buf):
+        raise ValueError(f"Frame of {size} bytes does not fit a {len(buf)} byte buffer")
+    view = memoryview(buf)[:size]
+    recv_exact_into(sock, view)
+    return view
+
+
+def recv_frame(sock):
+    """Receive a single length-prefixed frame, or None on a clean disconnect"""
+    first = sock.recv(FRAME_HEADER.size)
+    if not first:
+        return None
+    header = first + recv_exact(sock, FRAME_HEADER.size - len(first))
+    (size,) = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame too large: {size} bytes")
+    return recv_exact(sock, size)
+
+
+class FrameReader:
+    """Buffered frame reader for a non-blocking socket
+
+    Each time the socket is readable, everything queued in the kernel is
+    read into one buffer, so a small request costs a single read syscall
+    instead of one for the header and one for the payload, and pipelined
+    requests are parsed from the same buffer.
+    """
+
+    def __init__(self, sock, max_frame_size=MAX_FRAME_SIZE):
+        self.sock = sock
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Append received bytes to the buffer"""
+        self.buffer += data
+
+    def frames(self):
+        """Remove and return every complete frame in the buffer"""
+        frames = []
+        buf = self.buffer
+        while len(buf) >= FRAME_HEADER.size:
+            (size,) = FRAME_HEADER.unpack_from(buf)
+            if size > self.max_frame_size:
+                raise ValueError(f"Frame too large: {size} bytes")
+            end = FRAME_HEADER.size + size
+            if len(buf) < end:
+                break
+            frames.append(bytes(buf[FRAME_HEADER.size:end]))
+            del buf[:end]
+        return frames
+
+    def fill(self, limit=None):
+        """Drain the socket into the buffer; False once the peer has hung up.
+
+        Stops early once the buffer holds limit bytes. Raises BlockingIOError
+        if nothing was queued (a spurious wakeup).
+        """
+        data = self.sock.recv(RECV_SIZE)
+        if not data:
+            return False
+        self.feed(data)
+        while limit is None or len(self.buffer) < limit:
+            try:
+                data = self.sock.recv(RECV_SIZE)
+            except (BlockingIOError, InterruptedError):
+                break
+            if not data:
+                # EOF is reported by the next read
+                break
+            self.feed(data)
+        return True
+
+
+def pack_message(message):
+    """Encode a JSON control message as a complete frame"""
+    return pack_frame(dumps(message))
+
+
+def send_message(sock, message):
+    """Send a JSON control message"""
+    sock.sendall(pack_message(message))
+
+
+def recv_message(sock):
+    """Receive a JSON control message, or None on a clean disconnect"""
+    frame = recv_frame(sock)
+    if frame is None:
+        return None
+    return loads(frame)
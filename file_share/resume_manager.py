@@ -1,20 +1,38 @@
-import json
+import atexit
+import os
+import threading
 import time
 from pathlib import Path
 from typing import Dict, Optional
 
+from file_share.jsonutil import dumps, loads
+
+# Seconds between background flushes of progress updates
+FLUSH_INTERVAL = 2.0
+
 
 class ResumeManager:
-    def __init__(self, state_file: str = "download_state.json"):
+    def __init__(self, state_file: str = "download_state.json", flush_interval: float = FLUSH_INTERVAL):
         self.state_file = Path(state_file)
+        self._lock = threading.Lock()
+        # Serializes snapshot + write + rename so saves land in snapshot order
+        # and never share the temp file; progress updates only take _lock
+        self._write_lock = threading.Lock()
+        self._dirty = False
         self.download_states: Dict[str, Dict] = self._load_states()
 
+        # Progress updates only mark the state dirty; a daemon thread writes
+        # them out periodically and atexit catches whatever is left
+        self._flusher = threading.Thread(target=self._flush_loop, args=(flush_interval,), daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
     def _load_states(self) -> Dict:
         """Load download states from file"""
         if self.state_file.exists():
             try:
-                with open(self.state_file, 'r') as f:
-                    states = json.load(f)
+                with open(self.state_file, 'rb') as f:
+                    states = loads(f.read())
                     # Filter out old entries (older than 7 days)
                     current_time = time.time()
                     valid_states = {}
@@ -34,40 +52,58 @@ class ResumeManager:
         return {}
 
     def save_states(self):
-        """Save download states to file"""
-        try:
-            with open(self.state_file, 'w') as f:
-                json.dump(self.download_states, f, indent=2)
-        except Exception as e:
-            print(f"❌ Error saving download states: {e}")
+        """Atomically save download states to file"""
+        with self._write_lock:
+            with self._lock:
+                self._dirty = False
+                data = dumps(self.download_states)
+
+            tmp_path = self.state_file.with_name(self.state_file.name + '.tmp')
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, self.state_file)
+            except Exception as e:
+                print(f"❌ Error saving download states: {e}")
+
+    def flush(self):
+        """Save download states if there are unsaved progress updates"""
+        if self._dirty:
+            self.save_states()
+
+    def _flush_loop(self, interval: float):
+        while True:
+            time.sleep(interval)
+            self.flush()
 
     def register_download(self, filename: str, total_size: int, temp_path: str):
         """Register a new download"""
-        self.download_states[filename] = {
-            'total_size': total_size,
-            'downloaded': 0,
-            'temp_path': temp_path,
-            'active': True,
-            'timestamp': time.time(),
-            'started': time.strftime("%Y-%m-%d %H:%M:%S")
-        }
+        with self._lock:
+            self.download_states[filename] = {
+                'total_size': total_size,
+                'downloaded': 0,
+                'temp_path': temp_path,
+                'active': True,
+                'timestamp': time.time(),
+                'started': time.strftime("%Y-%m-%d %H:%M:%S")
+            }
         self.save_states()
 
     def update_progress(self, filename: str, downloaded: int):
-        """Update download progress"""
-        if filename in self.download_states:
-            self.download_states[filename]['downloaded'] = downloaded
-            self.download_states[filename]['last_updated'] = time.strftime("%Y-%m-%d %H:%M:%S")
-
-            # Only save to disk every 1MB to reduce I/O
-            if downloaded % (1024 * 1024) == 0:
-                self.save_states()
+        """Update download progress (written out by the background flusher)"""
+        with self._lock:
+            if filename in self.download_states:
+                self.download_states[filename]['downloaded'] = downloaded
+                self.download_states[filename]['last_updated'] = time.strftime("%Y-%m-%d %H:%M:%S")
+                self._dirty = True
 
     def complete_download(self, filename: str):
         """Mark download as complete and remove from state"""
-        if filename in self.download_states:
+        with self._lock:
+            if filename not in self.download_states:
+                return
             del self.download_states[filename]
-            self.save_states()
+        self.save_states()
 
     def get_resume_info(self, filename: str) -> Optional[Dict]:
         """Get resume information for a file"""
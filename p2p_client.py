@@ -1,26 +1,53 @@
 #!/usr/bin/env python3
 import argparse
-import base64
+import hashlib
 import json
+import os
+import queue
 import socket
 import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from tqdm import tqdm
 
 # Import local modules
-from file_share.crypto import Crypto
+from file_share.config import Config
+from file_share.crypto import OVERHEAD, Crypto
+from file_share.protocol import CHUNK_SIZE, recv_frame, recv_frame_into, recv_message, send_message
 from file_share.resume_manager import ResumeManager
 
+# Default number of parallel connections per download (see --parallel)
+PIPELINE_DEPTH = 4
+
+
+def write_at(fd, data, offset):
+    """Write all of data at offset without touching the shared file position"""
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
 
 class P2PClient:
-    def __init__(self, download_dir='./downloads', key=None):
+    def __init__(self, download_dir='./downloads', key=None, crypto_config=None):
         if not key:
             raise ValueError("Encryption key is required")
 
-        self.crypto = Crypto(key)
+        crypto_config = crypto_config or {}
+        self.crypto = Crypto.from_config(key, crypto_config)
+        # Plaintext chunks carry no authentication, so they are refused unless
+        # this client is configured for a node running with encrypt_chunks off
+        self.allow_plaintext = not crypto_config.get('encrypt_chunks', True)
         self.key = key
         self.resume_manager = ResumeManager()
+        # Per-thread receive buffers for encrypted chunks, reused across requests
+        self._chunk_buffers = threading.local()
+        # Keep-alive control connections keyed by (host, port)
+        self._connections = {}
 
         # Create download directory
         self.download_dir = Path(download_dir)
@@ -33,48 +60,61 @@ class P2PClient:
         sock.settimeout(10)  # Reduced timeout for faster feedback
         return sock
 
-    def send_request(self, host, port, request, proxy_config=None):
-        """Send a request to the server and get response"""
-        print(f"🔗 Connecting to {host}:{port}...")
-        try:
-            # Connect to server
+    def _get_conn(self, host, port, proxy_config=None):
+        """Return the cached keep-alive connection to host:port, connecting if needed"""
+        sock = self._connections.get((host, port))
+        if sock is None:
+            print(f"🔗 Connecting to {host}:{port}...")
             sock = self.create_socket(proxy_config)
             sock.connect((host, port))
             print(f"✅ Connected to {host}:{port}")
+            self._connections[(host, port)] = sock
+        return sock
 
-            # Send request
-            request_json = json.dumps(request)
-            print(f"📤 Sending request: {request['command']}")
-            sock.send(request_json.encode('utf-8'))
-
-            # Receive response
-            response_data = b''
-            while True:
-                try:
-                    chunk = sock.recv(8192)
-                    if not chunk:
-                        break
-                    response_data += chunk
-                except socket.timeout:
-                    print("⏰ Socket timeout during receive")
-                    break
-
+    def _drop_conn(self, host, port):
+        """Close and forget the cached connection to host:port"""
+        sock = self._connections.pop((host, port), None)
+        if sock is not None:
             sock.close()
 
-            if not response_data:
-                print("❌ No response data received")
-                return None
-
-            # Parse response
-            try:
-                response = json.loads(response_data.decode('utf-8'))
-                print(f"📥 Received response: {response.get('status', 'unknown')}")
-                return response
-            except json.JSONDecodeError as e:
-                print(f"❌ Failed to parse JSON response: {e}")
-                print(f"📦 Raw response: {response_data[:200]}...")  # First 200 chars
-                return None
+    def close(self):
+        """Close all keep-alive connections"""
+        for host, port in list(self._connections):
+            self._drop_conn(host, port)
 
+    def send_request(self, host, port, request, proxy_config=None):
+        """Send a request to the server and get response"""
+        try:
+            while True:
+                reused = (host, port) in self._connections
+                sock = self._get_conn(host, port, proxy_config)
+                try:
+                    # Send request
+                    print(f"📤 Sending request: {request['command']}")
+                    send_message(sock, request)
+
+                    # Receive response
+                    response = recv_message(sock)
+                    if response is None:
+                        raise ConnectionError("Connection closed by peer")
+                    print(f"📥 Received response: {response.get('status', 'unknown')}")
+
+                    # A successful chunk header is followed by the raw encrypted chunk
+                    if request['command'] == 'download_chunk' and response.get('status') == 'success':
+                        response['chunk_data'] = recv_frame(sock)
+                    return response
+                except ConnectionError:
+                    self._drop_conn(host, port)
+                    # The node may have closed an idle keep-alive connection; retry once
+                    if not reused:
+                        raise
+                except Exception:
+                    self._drop_conn(host, port)
+                    raise
+
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            print(f"❌ Failed to parse JSON response: {e}")
+            return None
         except socket.timeout:
             print(f"⏰ Connection timeout to {host}:{port}")
             return None
@@ -85,18 +125,74 @@ class P2PClient:
             print(f"❌ Request failed: {e}")
             return None
 
+    def _fetch_chunk(self, pool, out_buffers, fd, host, port, filename, chunk_index, proxy_config=None):
+        """Fetch, decrypt and write one chunk over a pooled persistent connection.
+
+        The chunk is written at its own offset in fd. The plaintext is also
+        returned as a view into a buffer taken from out_buffers; the caller
+        hands the buffer back once it is done with it.
+        """
+        sock = pool.get()
+        try:
+            if sock is None:
+                sock = self.create_socket(proxy_config)
+                sock.connect((host, port))
+
+            send_message(sock, {
+                'command': 'download_chunk',
+                'filename': filename,
+                'chunk_index': chunk_index
+            })
+            response = recv_message(sock)
+            if response and response.get('status') == 'success':
+                if response.get('encrypted', True):
+                    buf = getattr(self._chunk_buffers, 'buf', None)
+                    if buf is None:
+                        buf = self._chunk_buffers.buf = bytearray(CHUNK_SIZE + OVERHEAD)
+                    encrypted_chunk = recv_frame_into(sock, buf)
+                    chunk_data = self.crypto.decrypt_into(encrypted_chunk, out_buffers.get())
+                elif self.allow_plaintext:
+                    chunk_data = recv_frame_into(sock, out_buffers.get())
+                else:
+                    # The chunk frame is left unread, so the connection is unusable
+                    sock.close()
+                    sock = None
+                    return {'status': 'error',
+                            'message': 'Node sent an unencrypted chunk; set crypto.encrypt_chunks '
+                                       'to false in the client config to accept it'}
+                write_at(fd, chunk_data, chunk_index * CHUNK_SIZE)
+                response['chunk_data'] = chunk_data
+            return response
+        except Exception:
+            if sock is not None:
+                sock.close()
+                sock = None
+            raise
+        finally:
+            pool.put(sock)
+
     def get_file_info(self, host, port, filename, proxy_config=None):
         """Get file information from server"""
         request = {'command': 'get_file_info', 'filename': filename}
         return self.send_request(host, port, request, proxy_config)
 
+    def get_chunk_hash(self, host, port, filename, chunk_index, proxy_config=None):
+        """Get the hash of a single chunk from server"""
+        request = {'command': 'get_chunk_hash', 'filename': filename, 'chunk_index': chunk_index}
+        return self.send_request(host, port, request, proxy_config)
+
     def request_file_list(self, host, port, proxy_config=None):
         """Get list of available files from server"""
         request = {'command': 'list_files'}
         return self.send_request(host, port, request, proxy_config)
 
-    def download_file_chunked(self, host, port, filename, save_path=None, resume=True, proxy_config=None):
-        """Download a file using chunked approach (compatible with P2P node)"""
+    def download_file_chunked(self, host, port, filename, save_path=None, resume=True, proxy_config=None,
+                              parallel=PIPELINE_DEPTH):
+        """Download a file using chunked approach (compatible with P2P node)
+
+        Chunks are fetched over `parallel` connections and written straight to
+        their offsets in a .part file, which is renamed once complete.
+        """
         if save_path is None:
             save_path = self.download_dir / filename
 
@@ -111,6 +207,7 @@ class P2PClient:
 
         file_size = file_info['file_info']['size']
         file_hash = file_info['file_info']['hash']
+        hash_algo = file_info['file_info'].get('hash_algo', 'sha256')
 
         print(f"📊 File size: {file_size:,} bytes")
 
@@ -118,58 +215,127 @@ class P2PClient:
         temp_path = Path(str(save_path) + '.part')
         final_path = Path(save_path)
 
-        # Handle resume
+        # Handle resume. Chunks may land out of order, so the .part file size says
+        # nothing about progress; the resume state tracks the contiguous prefix.
         existing_size = 0
         if resume and temp_path.exists():
-            existing_size = temp_path.stat().st_size
-            if existing_size < file_size:
+            state = self.resume_manager.get_resume_info(filename)
+            if state and state.get('total_size') == file_size and state.get('temp_path') == str(temp_path):
+                existing_size = min(state.get('downloaded', 0), temp_path.stat().st_size)
+                existing_size -= existing_size % CHUNK_SIZE
                 print(f"🔄 Resuming download from {existing_size:,} bytes")
             else:
-                print("❌ Partial file larger than server file, starting over")
-                temp_path.unlink()
-                existing_size = 0
+                print("❌ Partial file does not match server file, starting over")
+        if existing_size == 0:
+            self.resume_manager.register_download(filename, file_size, str(temp_path))
 
         # Download file in chunks
-        chunk_size = 1024 * 1024  # 1MB chunks
+        chunk_size = CHUNK_SIZE
         total_chunks = (file_size + chunk_size - 1) // chunk_size
+        parallel = max(1, parallel)
+
+        # Connections are opened lazily and reused across chunks; None marks a free slot
+        pool = queue.LifoQueue()
+        for _ in range(parallel):
+            pool.put(None)
+
+        # Plaintext buffers, one per chunk that can be in flight or being consumed
+        window = parallel * 2
+        out_buffers = queue.SimpleQueue()
+        for _ in range(window + 1):
+            out_buffers.put(bytearray(CHUNK_SIZE))
+
+        # A crash can leave the newest chunk of the prefix torn; check it against
+        # the node and fetch it again instead of failing the whole-file hash later
+        if existing_size:
+            last_index = existing_size // chunk_size - 1
+            reply = self.get_chunk_hash(host, port, filename, last_index, proxy_config)
+            if reply and reply.get('status') == 'success':
+                with open(temp_path, 'rb') as f:
+                    f.seek(last_index * chunk_size)
+                    local_hash = hashlib.new(reply['hash_algo'], f.read(chunk_size)).hexdigest()
+                if local_hash != reply['hash']:
+                    print(f"⚠️  Chunk {last_index} on disk is corrupt, downloading it again")
+                    existing_size -= chunk_size
+
+        # The file is hashed as chunks complete in order, while the plaintext is
+        # still in memory; a resumed download first hashes what is already on disk
+        hasher = hashlib.new(hash_algo)
+        if existing_size:
+            with open(temp_path, 'rb') as f:
+                remaining = existing_size
+                while remaining:
+                    data = f.read(min(remaining, chunk_size))
+                    if not data:
+                        break
+                    hasher.update(data)
+                    remaining -= len(data)
 
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if existing_size == 0 else 0)
+        fd = os.open(temp_path, flags, 0o644)
         try:
-            with open(final_path, 'wb' if existing_size == 0 else 'ab') as f:
+            with ThreadPoolExecutor(max_workers=parallel) as executor:
+                # Streaming write: let the kernel tune readahead and page cache eviction
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
                 with tqdm(total=file_size, unit='B', unit_scale=True,
                           desc=f"Downloading {filename}", initial=existing_size) as pbar:
 
                     start_chunk = existing_size // chunk_size
 
-                    for chunk_index in range(start_chunk, total_chunks):
-                        # Request chunk from server
-                        request = {
-                            'command': 'download_chunk',
-                            'filename': filename,
-                            'chunk_index': chunk_index
-                        }
+                    # Keep a bounded window of requests in flight across the
+                    # connections; results are collected in chunk order
+                    chunk_indices = iter(range(start_chunk, total_chunks))
+                    pending = deque()
+
+                    def submit_next():
+                        chunk_index = next(chunk_indices, None)
+                        if chunk_index is not None:
+                            pending.append((chunk_index, executor.submit(
+                                self._fetch_chunk, pool, out_buffers, fd, host, port, filename, chunk_index,
+                                proxy_config)))
 
-                        response = self.send_request(host, port, request, proxy_config)
+                    for _ in range(window):
+                        submit_next()
+
+                    while pending:
+                        chunk_index, future = pending.popleft()
+                        response = future.result()
 
                         if not response or response.get('status') != 'success':
                             error_msg = response.get('message', 'Unknown error') if response else 'No response'
                             print(f"\n❌ Error downloading chunk {chunk_index}: {error_msg}")
+                            for _, other in pending:
+                                other.cancel()
                             return None
 
-                        # Decrypt and write chunk
-                        encrypted_chunk = base64.b64decode(response['chunk_data'])
-                        chunk_data = self.crypto.decrypt(encrypted_chunk)
+                        submit_next()
 
-                        f.write(chunk_data)
-                        f.flush()
+                        # Chunk is already on disk; everything before it is too
+                        chunk_data = response['chunk_data']
+                        hasher.update(chunk_data)
+                        out_buffers.put(chunk_data.obj)
+                        self.resume_manager.update_progress(filename, chunk_index * chunk_size + len(chunk_data))
 
                         pbar.update(len(chunk_data))
 
                         # Update progress every chunk
-                        current_pos = existing_size + (chunk_index - start_chunk + 1) * len(chunk_data)
                         pbar.set_postfix_str(f"Chunk {chunk_index + 1}/{total_chunks}")
 
+            os.close(fd)
+            fd = None
+
+            if hasher.hexdigest() != file_hash:
+                print(f"❌ Hash mismatch for {filename}: expected {file_hash}, got {hasher.hexdigest()}")
+                temp_path.unlink()
+                self.resume_manager.complete_download(filename)
+                return None
+
             # Verify file size
-            final_size = final_path.stat().st_size
+            final_size = temp_path.stat().st_size
+            os.replace(temp_path, final_path)
+            self.resume_manager.complete_download(filename)
             if final_size == file_size:
                 print(f"✅ Download completed: {final_path} ({final_size:,} bytes)")
                 return str(final_path)
@@ -181,6 +347,13 @@ class P2PClient:
             print(f"❌ Download failed: {e}")
             # Don't delete partial file for resume capability
             return None
+        finally:
+            if fd is not None:
+                os.close(fd)
+            while not pool.empty():
+                sock = pool.get()
+                if sock is not None:
+                    sock.close()
 
     def list_incomplete_downloads(self):
         """List all incomplete downloads that can be resumed"""
@@ -271,6 +444,7 @@ Examples:
     parser.add_argument('--host', default='localhost', help='Server host address (default: localhost)')
     parser.add_argument('--port', type=int, default=8080, help='Server port (default: 8080)')
     parser.add_argument('--download-dir', default='./downloads', help='Download directory (default: ./downloads)')
+    parser.add_argument('--config', help='Configuration file to read crypto settings from (must match the node)')
 
     # Proxy options (optional)
     parser.add_argument('--proxy-type', choices=['socks5', 'socks4', 'http'], help='Proxy type')
@@ -281,9 +455,13 @@ Examples:
 
     # Encryption (required)
     parser.add_argument('--key', required=True, help='Encryption key (min 8 characters)')
+    parser.add_argument('--cache-key', action='store_true',
+                        help='Cache the derived key on disk for faster startup (trusted machines only)')
 
     # Download options
     parser.add_argument('--no-resume', action='store_true', help='Disable resume functionality')
+    parser.add_argument('--parallel', type=int, default=PIPELINE_DEPTH, metavar='N',
+                        help=f'Parallel connections per download (default: {PIPELINE_DEPTH})')
 
     # Actions (mutually exclusive)
     action_group = parser.add_mutually_exclusive_group(required=True)
@@ -313,8 +491,13 @@ Examples:
         }
         print(f"🔌 Using {args.proxy_type} proxy: {args.proxy_host}:{args.proxy_port}")
 
+    client = None
     try:
-        client = P2PClient(download_dir=args.download_dir, key=args.key)
+        crypto_config = Config(args.config).get_crypto_config() if args.config else {}
+        if args.cache_key:
+            crypto_config['cache_key'] = True
+
+        client = P2PClient(download_dir=args.download_dir, key=args.key, crypto_config=crypto_config)
 
         if args.list_incomplete:
             client.list_incomplete_downloads()
@@ -346,7 +529,8 @@ Examples:
                 args.port,
                 args.download,
                 resume=not args.no_resume,
-                proxy_config=proxy_config
+                proxy_config=proxy_config,
+                parallel=args.parallel
             )
             if not result:
                 print("❌ Download failed")
@@ -383,6 +567,9 @@ Examples:
     except Exception as e:
         print(f"❌ Unexpected error: {e}")
         sys.exit(1)
+    finally:
+        if client is not None:
+            client.close()
 
 
 if __name__ == '__main__':
@@ -1,22 +1,91 @@
 #!/usr/bin/env python3
-import base64
 import hashlib
+import itertools
 import json
+import os
+import selectors
 import socket
+import stat
 import threading
 import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from types import MappingProxyType
 
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
+from file_share.crypto import Crypto
+from file_share.jsonutil import loads
+from file_share.protocol import CHUNK_SIZE, FRAME_HEADER, FrameReader, pack_message
+
+# Advertised to clients as file_info['hash_algo'] so they verify downloads
+# with the same function. SHA-256 runs on SHA-NI where available.
+HASH_ALGO = 'sha256'
+# Watchdog events are applied as one batch once none has arrived for
+# DEBOUNCE_SECONDS, or at the latest MAX_DEBOUNCE_SECONDS after the first one
+DEBOUNCE_SECONDS = 0.25
+MAX_DEBOUNCE_SECONDS = 2.0
+# update_available_files calls within this window share a single rescan
+RESCAN_COOLDOWN = 0.5
+# Threads that build responses (file reads and chunk encryption) for the event loop
+WORKER_THREADS = os.cpu_count() or 4
+# Per-connection input limits. Requests are handled one at a time, so a client
+# that pipelines faster than it reads replies is paused instead of buffered.
+MAX_REQUEST_SIZE = 64 * 1024
+MAX_QUEUED_REQUESTS = 16
+MAX_INPUT_BUFFER = 256 * 1024
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+HAS_SENDFILE = hasattr(os, 'sendfile')
+HAS_PREADV = hasattr(os, 'preadv')
+# Open handles kept for serving chunks, least recently used closed first
+MAX_OPEN_FILES = 64
+# Change-detection fields kept in available_files but never sent to clients
+STAT_FIELDS = ('inode', 'mtime_ns')
+# Fixed error replies, encoded once
+INVALID_JSON_FRAME = pack_message({'status': 'error', 'message': 'Invalid JSON'})
+INVALID_REQUEST_FRAME = pack_message({'status': 'error', 'message': 'Invalid request'})
+
 
 class ShareDirectoryHandler(FileSystemEventHandler):
-    def __init__(self, node):
+    def __init__(self, node, delay=DEBOUNCE_SECONDS, max_delay=MAX_DEBOUNCE_SECONDS):
         self.node = node
+        self.delay = delay
+        self.max_delay = max_delay
+        # Events collected until the flush thread hands them to the node as one batch
+        self._pending = []
+        self._first_event = self._last_event = 0.0
+        self._pending_ready = threading.Condition()
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _queue(self, event_type, src_path, dest_path=None):
+        with self._pending_ready:
+            now = time.monotonic()
+            if not self._pending:
+                self._first_event = now
+            self._last_event = now
+            self._pending.append((event_type, src_path, dest_path))
+            self._pending_ready.notify()
+
+    def _flush_loop(self):
+        # Trailing debounce, so a file that is still being written is hashed
+        # once the writes stop, capped so a busy file can't hold back the rest
+        while True:
+            with self._pending_ready:
+                while not self._pending:
+                    self._pending_ready.wait()
+                while True:
+                    deadline = min(self._last_event + self.delay, self._first_event + self.max_delay)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._pending_ready.wait(remaining)
+                batch, self._pending = self._pending, []
+            try:
+                self.node.apply_events(batch)
+            except Exception as e:
+                print(f"❌ Error applying file changes: {e}")
 
     def on_created(self, event):
         if not event.is_directory:
@@ -24,7 +93,16 @@ class ShareDirectoryHandler(FileSystemEventHandler):
             try:
                 if file_path.is_relative_to(self.node.share_dir):
                     print(f"📁 New file detected: {file_path.name}")
-                    self.node.update_available_files()
+                    self._queue('created', file_path)
+            except ValueError:
+                pass
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            file_path = Path(event.src_path)
+            try:
+                if file_path.is_relative_to(self.node.share_dir):
+                    self._queue('modified', file_path)
             except ValueError:
                 pass
 
@@ -34,7 +112,7 @@ class ShareDirectoryHandler(FileSystemEventHandler):
             try:
                 if file_path.is_relative_to(self.node.share_dir):
                     print(f"📁 File deleted: {file_path.name}")
-                    self.node.update_available_files()
+                    self._queue('deleted', file_path)
             except ValueError:
                 pass
 
@@ -45,11 +123,37 @@ class ShareDirectoryHandler(FileSystemEventHandler):
             try:
                 if src_path.is_relative_to(self.node.share_dir):
                     print(f"📁 File moved/renamed: {src_path.name} -> {dest_path.name}")
-                    self.node.update_available_files()
+                    self._queue('moved', src_path, dest_path)
             except ValueError:
                 pass
 
 
+class _FileRegion:
+    """A byte range of an open file, sent to the socket with os.sendfile"""
+
+    def __init__(self, fd, offset, count):
+        self.fd = fd
+        self.offset = offset
+        self.count = count
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Connection:
+    """Per-client state owned by the node's event loop"""
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.reader = FrameReader(sock, MAX_REQUEST_SIZE)
+        self.requests = deque()   # complete request frames not yet processed
+        self.outgoing = deque()   # response buffers not yet sent
+        self.events = selectors.EVENT_READ  # 0 while unregistered (paused, nothing to send)
+        self.busy = False         # a worker is building this connection's response
+        self.closed = False
+
+
 class P2PNode:
     def __init__(self, config):
         self.observer = None
@@ -58,22 +162,45 @@ class P2PNode:
         self.share_dir = Path(config['node']['share_dir'])
         self.key = config['node']['key']
         self.max_connections = config['node']['max_connections']
+        self.socket_buffer = config['node'].get('socket_buffer', 0)
+        self.crypto_config = config.get('crypto', {})
+        # The key itself is derived by start_server, but bad settings fail here
+        Crypto.check_config(self.key, self.crypto_config)
+        self._crypto = None
+        self._crypto_lock = threading.Lock()
+        # Plaintext chunks go out with sendfile; only for trusted networks
+        self.encrypt_chunks = self.crypto_config.get('encrypt_chunks', True)
 
         # Create share directory if it doesn't exist
         self.share_dir.mkdir(exist_ok=True)
 
-        # Initialize encryption
-        self.fernet = self._derive_key(self.key)
-
         # Network properties
         self.peers = []
         self.connected_peers = []
         self.server_socket = None
         self.running = False
 
-        # File management
-        self.available_files = {}
+        # File management. available_files is a read-only snapshot that is
+        # replaced, never mutated, so readers use it without taking a lock.
+        self.available_files = MappingProxyType({})
+        # Guards the per-file caches below and the swap of a new snapshot
         self.file_lock = threading.Lock()
+        # Open handles of served files, LRU ordered: filename -> ((ino, size, mtime_ns), file).
+        # Chunks are read with preadv rather than mmap: a file truncated while
+        # mapped kills the process with SIGBUS, whereas a read just comes up short.
+        self._files = OrderedDict()
+        # Per-worker chunk read buffers, reused across requests
+        self._read_buffers = threading.local()
+        # Per-chunk hashes computed on request: filename -> (stamp, {chunk_index: hex digest}).
+        # A new stamp in the index means the file changed, which discards the old hashes.
+        self._chunk_hashes = {}
+        # Rescan coalescing, plus a lock so rescans and event batches don't
+        # rebuild the index from the same snapshot and drop each other's changes
+        self._pending_rescan = False
+        self._rescan_lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        # Serialized list_files response, rebuilt whenever the index changes
+        self._list_files_frame = pack_message(self._file_listing({}))
 
         # Scan shared files
         self.scan_shared_files()
@@ -84,30 +211,37 @@ class P2PNode:
         print(f"🚀 P2P Node initialized on {self.host}:{self.port}")
         print(f"📁 Share directory: {self.share_dir}")
 
+    @property
+    def crypto(self):
+        """Chunk cipher, derived once and shared by all connections"""
+        # The lock keeps concurrent first requests from each running the KDF
+        if self._crypto is None:
+            with self._crypto_lock:
+                if self._crypto is None:
+                    self._crypto = self._derive_key(self.key)
+        return self._crypto
+
     def _derive_key(self, password):
-        """Derive a Fernet key from the password"""
-        password_bytes = password.encode()
-        salt = b'p2p_fileshare_salt_'  # In production, use a random salt
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(password_bytes))
-        return Fernet(key)
+        """Derive the chunk cipher from the password (shared with the client)"""
+        return Crypto.from_config(password, self.crypto_config)
 
     def scan_shared_files(self):
         """Scan and index all files in the share directory"""
         files = {}
         try:
-            for file_path in self.share_dir.iterdir():
-                if file_path.is_file():
-                    file_info = self._get_file_info(file_path)
-                    files[file_path.name] = file_info
-
-            with self.file_lock:
-                self.available_files = files
+            with self._index_lock:
+                previous = self.available_files
+                with os.scandir(self.share_dir) as entries:
+                    for entry in entries:
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        file_info = self._reuse_file_info(
+                            Path(entry.path), entry.stat(), previous.get(entry.name))
+                        # Unreadable files are reported by _get_file_info and skipped
+                        if file_info:
+                            files[entry.name] = file_info
+
+                self._set_available_files(files)
 
             print(f"📊 Found {len(files)} files in share directory")
             return files
@@ -115,17 +249,47 @@ class P2PNode:
             print(f"❌ Error scanning shared files: {e}")
             return {}
 
-    def _get_file_info(self, file_path):
-        """Get file information including hash and size"""
-        file_hash = hashlib.md5()
+    def _reuse_file_info(self, file_path, st, file_info):
+        """Reuse the previous hash while inode, mtime and size are unchanged"""
+        if not (file_info and file_info['inode'] == st.st_ino
+                and file_info['mtime_ns'] == st.st_mtime_ns and file_info['size'] == st.st_size):
+            file_info = self._get_file_info(file_path, st)
+        return file_info
+
+    def _set_available_files(self, files):
+        """Publish a new file index as an immutable snapshot"""
+        listing = pack_message(self._file_listing(files))
+        with self.file_lock:
+            self.available_files = MappingProxyType(files)
+            self._list_files_frame = listing
+            # Forget handles of deleted or renamed files; in-flight readers
+            # keep their reference and the file closes once they finish
+            for name in list(self._files):
+                if name not in files:
+                    del self._files[name]
+            for name in list(self._chunk_hashes):
+                if name not in files:
+                    del self._chunk_hashes[name]
+
+    def _get_file_info(self, file_path, st=None):
+        """Get file information including hash, size and the stat fields used to detect changes"""
         try:
             with open(file_path, 'rb') as f:
-                while chunk := f.read(8192):
-                    file_hash.update(chunk)
+                if hasattr(hashlib, 'file_digest'):
+                    file_hash = hashlib.file_digest(f, HASH_ALGO)
+                else:
+                    file_hash = hashlib.new(HASH_ALGO)
+                    while chunk := f.read(1024 * 1024):
+                        file_hash.update(chunk)
+            if st is None:
+                st = file_path.stat()
             return {
-                'size': file_path.stat().st_size,
+                'size': st.st_size,
                 'hash': file_hash.hexdigest(),
-                'path': str(file_path)
+                'hash_algo': HASH_ALGO,
+                'path': str(file_path),
+                'inode': st.st_ino,
+                'mtime_ns': st.st_mtime_ns
             }
         except Exception as e:
             print(f"❌ Error reading file {file_path}: {e}")
@@ -136,7 +300,9 @@ class P2PNode:
         try:
             event_handler = ShareDirectoryHandler(self)
             self.observer = Observer()
-            self.observer.schedule(event_handler, str(self.share_dir), recursive=True)
+            # Only top-level files are shared, so one watch on the directory is
+            # enough; recursive mode adds an inotify watch per subdirectory
+            self.observer.schedule(event_handler, str(self.share_dir), recursive=False)
             self.observer.start()
             print(f"👀 Monitoring share directory: {self.share_dir}")
         except Exception as e:
@@ -149,32 +315,38 @@ class P2PNode:
         self.polling_active = True
 
         def poll_files():
-            last_files = set(self.available_files.keys())
+            # Goes through the rescan cooldown, so a scan that outlasts the
+            # interval is not queued up behind itself
             while self.polling_active:
                 time.sleep(interval)
-                try:
-                    current_files = set(self.scan_shared_files().keys())
-
-                    added = current_files - last_files
-                    removed = last_files - current_files
-
-                    if added:
-                        print(f"✅ New files available: {', '.join(added)}")
-                    if removed:
-                        print(f"❌ Files removed: {', '.join(removed)}")
-
-                    last_files = current_files
-                except Exception as e:
-                    print(f"❌ Error in file polling: {e}")
+                self.update_available_files()
 
         self.polling_thread = threading.Thread(target=poll_files, daemon=True)
         self.polling_thread.start()
         print(f"🔍 Polling share directory every {interval} seconds")
 
     def update_available_files(self):
-        """Update the list of available files and notify peers"""
+        """Schedule a rescan; requests within the cooldown share a single scan"""
+        with self._rescan_lock:
+            if self._pending_rescan:
+                return
+            self._pending_rescan = True
+        timer = threading.Timer(RESCAN_COOLDOWN, self._do_rescan)
+        timer.daemon = True
+        timer.start()
+
+    def _do_rescan(self):
+        """Rescan the share directory and notify peers"""
+        # Clear the flag first so changes made during the scan schedule another one
+        with self._rescan_lock:
+            self._pending_rescan = False
+
         old_files = set(self.available_files.keys())
-        new_files = self.scan_shared_files()
+        try:
+            new_files = self.scan_shared_files()
+        except Exception as e:
+            print(f"❌ Error rescanning share directory: {e}")
+            return
 
         added = set(new_files.keys()) - old_files
         removed = old_files - set(new_files.keys())
@@ -187,6 +359,50 @@ class P2PNode:
         # Notify connected peers about file changes
         self.notify_peers_about_changes()
 
+    def apply_events(self, events):
+        """Apply a batch of watcher events, re-hashing only the paths they touch"""
+        # Only direct children are shared; the move target matters too
+        touched = set()
+        renamed_from = {}
+        for event_type, src_path, dest_path in events:
+            for path in (src_path, dest_path):
+                if path is not None and path.parent == self.share_dir:
+                    touched.add(path.name)
+            if dest_path is not None:
+                renamed_from[dest_path.name] = src_path.name
+
+        with self._index_lock:
+            old_files = self.available_files
+            files = dict(old_files)
+            for name in touched:
+                file_path = self.share_dir / name
+                try:
+                    st = file_path.lstat()
+                except OSError:
+                    st = None
+                file_info = None
+                if st and stat.S_ISREG(st.st_mode):
+                    # A renamed file keeps its inode and mtime, so its old hash still applies
+                    file_info = old_files.get(name) or old_files.get(renamed_from.get(name))
+                    file_info = self._reuse_file_info(file_path, st, file_info)
+                    if file_info and file_info['path'] != str(file_path):
+                        file_info = dict(file_info, path=str(file_path))
+                if file_info:
+                    files[name] = file_info
+                else:
+                    files.pop(name, None)
+
+            self._set_available_files(files)
+
+        added = set(files) - set(old_files)
+        removed = set(old_files) - set(files)
+        if added:
+            print(f"✅ New files available: {', '.join(added)}")
+        if removed:
+            print(f"❌ Files removed: {', '.join(removed)}")
+
+        self.notify_peers_about_changes()
+
     def notify_peers_about_changes(self):
         """Notify all connected peers about file changes"""
         # This would be implemented when we add peer-to-peer file change notifications
@@ -194,35 +410,32 @@ class P2PNode:
 
     def stop_file_watcher(self):
         """Stop the file watcher"""
-        if hasattr(self, 'observer'):
+        if self.observer is not None:
             self.observer.stop()
             self.observer.join()
         if hasattr(self, 'polling_active'):
             self.polling_active = False
 
-    def handle_client(self, client_socket, address):
-        """Handle incoming client connections"""
+    def _encode_response(self, data):
+        """Process one request frame and return the buffers to send back"""
         try:
-            print(f"🔗 Connection from {address}")
-
-            while True:
-                data = client_socket.recv(1024).decode('utf-8')
-                if not data:
-                    break
-
-                try:
-                    request = json.loads(data)
-                    response = self.process_request(request)
-                    client_socket.send(json.dumps(response).encode('utf-8'))
-                except json.JSONDecodeError:
-                    error_response = {'status': 'error', 'message': 'Invalid JSON'}
-                    client_socket.send(json.dumps(error_response).encode('utf-8'))
-
-        except Exception as e:
-            print(f"❌ Error handling client {address}: {e}")
-        finally:
-            client_socket.close()
-            print(f"🔒 Connection closed with {address}")
+            request = loads(data)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return [INVALID_JSON_FRAME]
+
+        if not isinstance(request, dict):
+            return [INVALID_REQUEST_FRAME]
+        if request.get('command') == 'list_files':
+            return [self._list_files_frame]
+
+        response = self.process_request(request)
+        # Chunk payloads travel as a raw frame after the JSON header
+        chunk_data = response.pop('chunk_data', None)
+        if chunk_data is None:
+            return [pack_message(response)]
+        if isinstance(chunk_data, _FileRegion):
+            return [pack_message(response) + FRAME_HEADER.pack(chunk_data.count), chunk_data]
+        return [pack_message(response) + FRAME_HEADER.pack(len(chunk_data)), chunk_data]
 
     def process_request(self, request):
         """Process client requests"""
@@ -237,50 +450,60 @@ class P2PNode:
                 request.get('filename'),
                 request.get('chunk_index')
             )
+        elif command == 'get_chunk_hash':
+            return self.get_chunk_hash(
+                request.get('filename'),
+                request.get('chunk_index')
+            )
         else:
             return {'status': 'error', 'message': 'Unknown command'}
 
     def list_files(self):
         """Return list of available files"""
-        with self.file_lock:
-            files_info = {
-                name: {'size': info['size'], 'hash': info['hash']}
-                for name, info in self.available_files.items()
-            }
+        return self._file_listing(self.available_files)
+
+    @staticmethod
+    def _file_listing(files):
+        """Build the list_files response for an index"""
+        files_info = {
+            name: {'size': info['size'], 'hash': info['hash'], 'hash_algo': info['hash_algo']}
+            for name, info in files.items()
+        }
         return {'status': 'success', 'files': files_info}
 
     def get_file_info(self, filename):
         """Get information about a specific file"""
-        with self.file_lock:
-            if filename in self.available_files:
-                return {
-                    'status': 'success',
-                    'file_info': self.available_files[filename]
-                }
-            else:
-                return {'status': 'error', 'message': 'File not found'}
+        file_info = self.available_files.get(filename)
+        if file_info is not None:
+            return {
+                'status': 'success',
+                'file_info': {k: v for k, v in file_info.items() if k not in STAT_FIELDS}
+            }
+        else:
+            return {'status': 'error', 'message': 'File not found'}
 
     def download_chunk(self, filename, chunk_index):
         """Serve a chunk of a file to the client"""
         try:
-            with self.file_lock:
-                if filename not in self.available_files:
-                    return {'status': 'error', 'message': 'File not found'}
+            file_info = self.available_files.get(filename)
+            if file_info is None:
+                return {'status': 'error', 'message': 'File not found'}
 
-                file_path = Path(self.available_files[filename]['path'])
+            if not isinstance(chunk_index, int) or chunk_index < 0:
+                return {'status': 'error', 'message': 'Invalid chunk index'}
 
-            # Read and encrypt the file chunk
-            chunk_size = 1024 * 1024  # 1MB chunks
-            with open(file_path, 'rb') as f:
-                f.seek(chunk_index * chunk_size)
-                chunk_data = f.read(chunk_size)
+            if not self.encrypt_chunks and HAS_SENDFILE:
+                return self._plain_chunk(Path(file_info['path']), chunk_index)
+
+            # Encrypt from the reused read buffer; the ciphertext is a new buffer
+            chunk_data = self._read_chunk(filename, file_info, chunk_index)
 
             if chunk_data:
-                encrypted_chunk = self.fernet.encrypt(chunk_data)
                 return {
                     'status': 'success',
-                    'chunk_data': base64.b64encode(encrypted_chunk).decode('utf-8'),
-                    'chunk_size': len(chunk_data)
+                    'chunk_data': self.crypto.encrypt(chunk_data) if self.encrypt_chunks else bytes(chunk_data),
+                    'chunk_size': len(chunk_data),
+                    'encrypted': self.encrypt_chunks
                 }
             else:
                 return {'status': 'error', 'message': 'Chunk not available'}
@@ -288,14 +511,121 @@ class P2PNode:
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
 
+    def get_chunk_hash(self, filename, chunk_index):
+        """Hash a single chunk so clients can check it without fetching the whole file"""
+        try:
+            file_info = self.available_files.get(filename)
+            if file_info is None:
+                return {'status': 'error', 'message': 'File not found'}
+
+            if not isinstance(chunk_index, int) or chunk_index < 0:
+                return {'status': 'error', 'message': 'Invalid chunk index'}
+
+            stamp = self._file_stamp(file_info)
+            with self.file_lock:
+                cached = self._chunk_hashes.get(filename)
+                if cached is None or cached[0] != stamp:
+                    cached = self._chunk_hashes[filename] = (stamp, {})
+            chunk_hashes = cached[1]
+
+            chunk_hash = chunk_hashes.get(chunk_index)
+            if chunk_hash is None:
+                chunk_data = self._read_chunk(filename, file_info, chunk_index)
+                if not chunk_data:
+                    return {'status': 'error', 'message': 'Chunk not available'}
+                chunk_hash = chunk_hashes[chunk_index] = hashlib.new(HASH_ALGO, chunk_data).hexdigest()
+
+            return {
+                'status': 'success',
+                'chunk_index': chunk_index,
+                'hash': chunk_hash,
+                'hash_algo': HASH_ALGO
+            }
+
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+
+    def _plain_chunk(self, file_path, chunk_index):
+        """Describe an unencrypted chunk as a file range for the event loop to sendfile"""
+        fd = os.open(file_path, os.O_RDONLY)
+        offset = chunk_index * CHUNK_SIZE
+        count = min(CHUNK_SIZE, os.fstat(fd).st_size - offset)
+        if count <= 0:
+            os.close(fd)
+            return {'status': 'error', 'message': 'Chunk not available'}
+        return {
+            'status': 'success',
+            'chunk_data': _FileRegion(fd, offset, count),
+            'chunk_size': count,
+            'encrypted': False
+        }
+
+    @staticmethod
+    def _file_stamp(file_info):
+        """The stat fields that identify one version of an indexed file"""
+        return file_info['inode'], file_info['size'], file_info['mtime_ns']
+
+    def _get_file(self, filename, file_info):
+        """Return a cached open handle of the file, reopening it if the index has a new version.
+
+        The watcher keeps the index current, so the handle is checked against
+        it instead of stat-ing the file for every chunk.
+        """
+        stamp = self._file_stamp(file_info)
+        with self.file_lock:
+            cached = self._files.get(filename)
+            if cached is not None and cached[0] == stamp:
+                self._files.move_to_end(filename)
+                return cached[1]
+
+        f = open(file_info['path'], 'rb', buffering=0)
+        with self.file_lock:
+            self._files[filename] = (stamp, f)
+            self._files.move_to_end(filename)
+            # Evicted handles close once in-flight readers drop them
+            while len(self._files) > MAX_OPEN_FILES:
+                self._files.popitem(last=False)
+        return f
+
+    def _read_chunk(self, filename, file_info, chunk_index):
+        """Read a chunk into this thread's buffer and return a view of the bytes read.
+
+        The view is only valid until the thread's next read. It comes up short
+        if the file shrank since it was indexed.
+        """
+        buf = getattr(self._read_buffers, 'buf', None)
+        if buf is None:
+            buf = self._read_buffers.buf = bytearray(CHUNK_SIZE)
+        view = memoryview(buf)
+        offset = chunk_index * CHUNK_SIZE
+
+        if not HAS_PREADV:
+            with open(file_info['path'], 'rb') as f:
+                f.seek(offset)
+                return view[:f.readinto(view)]
+
+        # Holding f keeps the descriptor open even if the cache drops it meanwhile
+        f = self._get_file(filename, file_info)
+        filled = 0
+        while filled < CHUNK_SIZE:
+            n = os.preadv(f.fileno(), [view[filled:]], offset + filled)
+            if not n:
+                break
+            filled += n
+        return view[:filled]
+
     def start_server(self):
         """Start the node server"""
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
         try:
+            # Pay for the KDF before accepting, not inside the first client's request
+            if self.encrypt_chunks:
+                self.crypto
             self.server_socket.bind((self.host, self.port))
             self.server_socket.listen(self.max_connections)
+            self.server_socket.setblocking(False)
             self.running = True
 
             print(f"🎯 Node listening on {self.host}:{self.port}")
@@ -304,29 +634,219 @@ class P2PNode:
                 print(f"   - {filename}")
             print("\n⏹️  Press Ctrl+C to stop the node")
 
-            while self.running:
-                try:
-                    client_socket, address = self.server_socket.accept()
-                    client_thread = threading.Thread(
-                        target=self.handle_client,
-                        args=(client_socket, address),
-                        daemon=True
-                    )
-                    client_thread.start()
-                except socket.timeout:
-                    continue
+            self._serve_forever()
 
         except Exception as e:
             print(f"❌ Server error: {e}")
         finally:
             self.stop()
 
+    def _serve_forever(self):
+        """Run the event loop: one thread multiplexes every connection and a small
+        pool does the request work (file reads and encryption release the GIL)"""
+        self._selector = selectors.DefaultSelector()
+        self._workers = ThreadPoolExecutor(max_workers=WORKER_THREADS)
+        # Workers hand results back through this queue and wake the loop via the socket pair
+        self._completed = deque()
+        # Open connections, including paused ones that are not in the selector
+        self._connections = set()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+
+        self._selector.register(self.server_socket, selectors.EVENT_READ, None)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ, self._wakeup_recv)
+        try:
+            while self.running:
+                for key, mask in self._selector.select(timeout=0.5):
+                    if key.data is None:
+                        self._accept()
+                    elif key.data is self._wakeup_recv:
+                        self._drain_completed()
+                    else:
+                        conn = key.data
+                        if mask & selectors.EVENT_WRITE:
+                            self._flush(conn)
+                        if mask & selectors.EVENT_READ and not conn.closed:
+                            self._on_readable(conn)
+        finally:
+            for conn in list(self._connections):
+                self._close(conn)
+            self._selector.close()
+            self._workers.shutdown(wait=False)
+            self._wakeup_recv.close()
+            self._wakeup_send.close()
+
+    def _accept(self):
+        """Accept every pending connection"""
+        while True:
+            try:
+                client_socket, address = self.server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            client_socket.setblocking(False)
+            self._tune_socket(client_socket)
+            print(f"🔗 Connection from {address}")
+            conn = _Connection(client_socket, address)
+            self._connections.add(conn)
+            self._selector.register(client_socket, selectors.EVENT_READ, conn)
+
+    def _tune_socket(self, sock):
+        """Apply per-connection socket options"""
+        # Small JSON replies must not wait behind Nagle for the ACK of the
+        # previous chunk; chunks are already handed over in one sendmsg
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Notice peers that vanished without closing the connection
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # Fixed buffer sizes turn off kernel autotuning, so only when configured
+        if self.socket_buffer:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.socket_buffer)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.socket_buffer)
+
+    def _on_readable(self, conn):
+        """Read whatever the client sent and queue the complete requests"""
+        try:
+            if not conn.reader.fill(MAX_INPUT_BUFFER):
+                self._close(conn)
+                return
+            conn.requests.extend(conn.reader.frames())
+        except (BlockingIOError, InterruptedError):
+            return
+        except (OSError, ValueError) as e:
+            print(f"❌ Error handling client {conn.address}: {e}")
+            self._close(conn)
+            return
+        self._dispatch(conn)
+        self._update_events(conn)
+
+    def _dispatch(self, conn):
+        """Hand the next request to a worker; one at a time keeps responses in order"""
+        if conn.busy or conn.outgoing or not conn.requests:
+            return
+        conn.busy = True
+        self._workers.submit(self._work, conn, conn.requests.popleft())
+
+    def _work(self, conn, data):
+        """Worker side of a request: build the response and wake the event loop"""
+        try:
+            buffers = self._encode_response(data)
+        except Exception as e:
+            print(f"❌ Error handling client {conn.address}: {e}")
+            buffers = None
+        self._completed.append((conn, buffers))
+        try:
+            self._wakeup_send.send(b'\0')
+        except (BlockingIOError, OSError):
+            # A wakeup is already pending or the loop has shut down
+            pass
+
+    def _drain_completed(self):
+        """Queue finished responses for sending"""
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while self._completed:
+            conn, buffers = self._completed.popleft()
+            if conn.closed:
+                self._release(buffers)
+                continue
+            conn.busy = False
+            if buffers is None:
+                self._close(conn)
+                continue
+            conn.outgoing.extend(buffers)
+            self._flush(conn)
+
+    def _flush(self, conn):
+        """Send as much queued output as the socket takes without blocking"""
+        try:
+            while conn.outgoing:
+                head = conn.outgoing[0]
+                if isinstance(head, _FileRegion):
+                    sent = os.sendfile(conn.sock.fileno(), head.fd, head.offset, head.count)
+                    if not sent:
+                        raise ConnectionError("File shrank while sending")
+                    head.offset += sent
+                    head.count -= sent
+                    if head.count:
+                        break
+                    conn.outgoing.popleft().close()
+                    continue
+
+                # Gather the JSON header and chunk into a single syscall where supported
+                if HAS_SENDMSG:
+                    sent = conn.sock.sendmsg(list(itertools.takewhile(
+                        lambda buf: not isinstance(buf, _FileRegion), conn.outgoing)))
+                else:
+                    sent = conn.sock.send(head)
+                while sent and sent >= len(conn.outgoing[0]):
+                    sent -= len(conn.outgoing.popleft())
+                if sent:
+                    conn.outgoing[0] = memoryview(conn.outgoing[0])[sent:]
+                    break
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as e:
+            print(f"❌ Error handling client {conn.address}: {e}")
+            self._close(conn)
+            return
+
+        self._dispatch(conn)
+        self._update_events(conn)
+
+    def _update_events(self, conn):
+        """Watch for output space while there is output, and for input until the backlog is full"""
+        if conn.closed:
+            return
+        events = 0
+        if len(conn.requests) < MAX_QUEUED_REQUESTS and len(conn.reader.buffer) < MAX_INPUT_BUFFER:
+            events |= selectors.EVENT_READ
+        if conn.outgoing:
+            events |= selectors.EVENT_WRITE
+        if events == conn.events:
+            return
+        # The selector takes no empty interest set, so an idle paused connection is unregistered
+        if not events:
+            self._selector.unregister(conn.sock)
+        elif not conn.events:
+            self._selector.register(conn.sock, events, conn)
+        else:
+            self._selector.modify(conn.sock, events, conn)
+        conn.events = events
+
+    def _close(self, conn):
+        """Unregister and close a client connection"""
+        if conn.closed:
+            return
+        conn.closed = True
+        self._connections.discard(conn)
+        try:
+            self._selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        conn.sock.close()
+        self._release(conn.outgoing)
+        conn.outgoing.clear()
+        print(f"🔒 Connection closed with {conn.address}")
+
+    @staticmethod
+    def _release(buffers):
+        """Close the files behind unsent sendfile ranges"""
+        for buf in buffers or ():
+            if isinstance(buf, _FileRegion):
+                buf.close()
+
     def stop(self):
         """Stop the node"""
         self.running = False
         self.stop_file_watcher()
         if self.server_socket:
             self.server_socket.close()
+        with self.file_lock:
+            self._files.clear()
+            self._chunk_hashes.clear()
         print("🛑 Node stopped")
 
 
@@ -349,7 +869,11 @@ def main():
         print(f"❌ Invalid JSON in configuration file {args.config}!")
         return
 
-    node = P2PNode(config)
+    try:
+        node = P2PNode(config)
+    except ValueError as e:
+        print(f"❌ Invalid configuration: {e}")
+        return
 
     try:
         node.start_server()